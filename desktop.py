@@ -1,98 +1,170 @@
-from datetime import datetime, timedelta
-from typing import List, Dict
+from datetime import datetime, timedelta, timezone
+import time
+from typing import Dict, Iterator, List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import DateTime, Integer, and_, case, cast, extract, func, literal, select, union_all
 
 # Import the Ticket model from your models module
-from .models import Ticket  # Use relative import if models.py is in the same directory
+from models import Customer, SLATarget, Ticket
 
 # Business hours: Monday-Friday, 9 AM - 6 PM (9 hours per day)
+BUSINESS_DAY_START_MINUTE = 9 * 60
+BUSINESS_DAY_END_MINUTE = 18 * 60
+BUSINESS_MINUTES_PER_DAY = BUSINESS_DAY_END_MINUTE - BUSINESS_DAY_START_MINUTE
+BUSINESS_DAYS_PER_WEEK = 5
+BUSINESS_MINUTES_PER_WEEK = BUSINESS_DAYS_PER_WEEK * BUSINESS_MINUTES_PER_DAY
+
+# Indexed by weekday: business minutes elapsed before the day starts, and
+# whether the day itself has business hours
+CUMULATIVE_BUSINESS_MINUTES_BY_WEEKDAY = tuple(
+    min(day, BUSINESS_DAYS_PER_WEEK) * BUSINESS_MINUTES_PER_DAY for day in range(7)
+)
+IS_BUSINESS_DAY = tuple(int(day < BUSINESS_DAYS_PER_WEEK) for day in range(7))
+
+BREACH_SCAN_BATCH_SIZE = 1000
+
+# SLA targets are small reference data; reload them at most once a minute
+SLA_TARGETS_TTL_SECONDS = 60
+
 def add_business_hours(start_time: datetime, hours: float) -> datetime:
-    business_hours_per_day = 9
-    current_time = start_time
-    remaining_hours = hours
-
-    while remaining_hours > 0:
-        # Skip weekends
-        if current_time.weekday() >= 5:  # Saturday = 5, Sunday = 6
-            current_time += timedelta(days=1)
-            current_time = current_time.replace(hour=9, minute=0, second=0, microsecond=0)
-            continue
-
-        # If outside business hours, move to next business day
-        if current_time.hour < 9:
-            current_time = current_time.replace(hour=9, minute=0, second=0, microsecond=0)
-        elif current_time.hour >= 18:
-            current_time += timedelta(days=1)
-            current_time = current_time.replace(hour=9, minute=0, second=0, microsecond=0)
-            continue
-
-        # Calculate hours remaining in current business day
-        hours_left_today = 18 - current_time.hour - (current_time.minute / 60.0)
-
-        if remaining_hours <= hours_left_today:
-            # Can finish today
-            current_time += timedelta(hours=remaining_hours)
-            remaining_hours = 0
-        else:
-            # Need to continue tomorrow
-            remaining_hours -= hours_left_today
-            current_time += timedelta(days=1)
-            current_time = current_time.replace(hour=9, minute=0, second=0, microsecond=0)
-
-    return current_time
+    if hours <= 0:
+        return start_time
+
+    # Position of start_time on the business-minute axis, counted from the
+    # Monday of its week. Times outside business hours snap to the next opening.
+    weekday = start_time.weekday()
+    week_start = start_time.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=weekday)
+
+    minute_of_day = (
+        start_time.hour * 60 + start_time.minute
+        + (start_time.second + start_time.microsecond / 1e6) / 60.0
+    )
+    offset = min(max(minute_of_day - BUSINESS_DAY_START_MINUTE, 0), BUSINESS_MINUTES_PER_DAY)
+    start_index = (
+        CUMULATIVE_BUSINESS_MINUTES_BY_WEEKDAY[weekday]
+        + IS_BUSINESS_DAY[weekday] * offset
+    )
+
+    # Map the target index back to a calendar date; a target landing exactly on
+    # a day boundary is closing time of that day, not opening of the next one.
+    business_day, minute_in_day = divmod(start_index + hours * 60, BUSINESS_MINUTES_PER_DAY)
+    if minute_in_day == 0:
+        business_day -= 1
+        minute_in_day = BUSINESS_MINUTES_PER_DAY
+
+    weeks, day_in_week = divmod(int(business_day), BUSINESS_DAYS_PER_WEEK)
+    # day_in_week is always Monday-Friday, so it is also the calendar offset
+    return week_start + timedelta(
+        days=weeks * 7 + day_in_week,
+        minutes=BUSINESS_DAY_START_MINUTE + minute_in_day
+    )
 
 class SLAService:
-    def check_sla_breaches(self, db: Session) -> List[Dict]:
-        '''Check for current SLA breaches'''
+    def __init__(self):
+        self._targets = {}
+        self._targets_loaded_at = None
+
+    def load_sla_targets(self, db: Session) -> None:
+        '''Cache SLA targets as (customer_tier, priority) -> (first_response_hours, resolution_hours)'''
+
+        rows = db.query(
+            SLATarget.customer_tier,
+            SLATarget.priority,
+            SLATarget.first_response_hours,
+            SLATarget.resolution_hours
+        ).all()
+
+        self._targets = {
+            (row.customer_tier, row.priority): (row.first_response_hours, row.resolution_hours)
+            for row in rows
+        }
+        self._targets_loaded_at = time.monotonic()
+
+    def calculate_sla_targets(self, db: Session, priority: str, customer_tier: str, created_at: datetime) -> Dict:
+        '''Calculate first response and resolution due times for a new ticket'''
 
-        current_time = datetime.utcnow()
-        breached_tickets = []
+        if self._targets_loaded_at is None or time.monotonic() - self._targets_loaded_at > SLA_TARGETS_TTL_SECONDS:
+            self.load_sla_targets(db)
 
-        # Find tickets with breached first response SLA
-        first_response_breaches = db.query(Ticket).filter(
+        target = self._targets.get((customer_tier or 'standard', priority))
+        if not target:
+            return {'first_response': None, 'resolution': None}
+
+        first_response_hours, resolution_hours = target
+        return {
+            'first_response': add_business_hours(created_at, first_response_hours),
+            'resolution': add_business_hours(created_at, resolution_hours)
+        }
+
+    def check_sla_breaches(self, db: Session, current_time: Optional[datetime] = None) -> List[Dict]:
+        '''Check for SLA breaches as of current_time (defaults to now, UTC)'''
+
+        return list(self.iter_sla_breaches(db, current_time))
+
+    def iter_sla_breaches(self, db: Session, current_time: Optional[datetime] = None) -> Iterator[Dict]:
+        '''Yield SLA breaches as of current_time (defaults to now, UTC)
+
+        Rows are streamed from a server-side cursor, so the session must stay
+        open until the iterator is exhausted, and it can only be consumed once.
+        '''
+
+        if current_time is None:
+            current_time = datetime.now(timezone.utc)
+        now = literal(current_time, DateTime(timezone=True))
+
+        # Both breach types in one round-trip; tier comes from the join rather
+        # than a lazy load per ticket.
+        first_response_breaches = select(
+            Ticket.id.label('ticket_id'),
+            literal('first_response').label('breach_type'),
+            cast(func.floor(extract('epoch', now - Ticket.first_response_due)), Integer).label('breach_seconds'),
+            Ticket.priority,
+            func.coalesce(Customer.tier, 'standard').label('customer_tier')
+        ).outerjoin(Customer, Ticket.customer_id == Customer.id).where(
             and_(
                 Ticket.first_response_due < current_time,
                 Ticket.first_response_at.is_(None),
                 Ticket.status != 'closed'
             )
-        ).all()
+        )
 
-        for ticket in first_response_breaches:
-            breach_time = current_time - ticket.first_response_due
-            breached_tickets.append({
-                'ticket_id': ticket.id,
-                'breach_type': 'first_response',
-                'breach_duration': str(breach_time),
-                'priority': ticket.priority,
-                'customer_tier': ticket.customer.tier if ticket.customer else 'standard'
-            })
-
-        # Find tickets with breached resolution SLA
-        resolution_breaches = db.query(Ticket).filter(
+        resolution_breaches = select(
+            Ticket.id.label('ticket_id'),
+            literal('resolution').label('breach_type'),
+            cast(func.floor(extract('epoch', now - Ticket.resolution_due)), Integer).label('breach_seconds'),
+            Ticket.priority,
+            func.coalesce(Customer.tier, 'standard').label('customer_tier')
+        ).outerjoin(Customer, Ticket.customer_id == Customer.id).where(
             and_(
                 Ticket.resolution_due < current_time,
                 Ticket.resolved_at.is_(None),
                 Ticket.status != 'closed'
             )
-        ).all()
+        )
 
-        for ticket in resolution_breaches:
-            breach_time = current_time - ticket.resolution_due
-            breached_tickets.append({
-                'ticket_id': ticket.id,
-                'breach_type': 'resolution',
-                'breach_duration': str(breach_time),
-                'priority': ticket.priority,
-                'customer_tier': ticket.customer.tier if ticket.customer else 'standard'
-            })
+        # Stream rows in batches and hand them out one at a time, so memory
+        # stays bounded by the batch size rather than the number of breaches
+        rows = db.execute(
+            union_all(first_response_breaches, resolution_breaches),
+            execution_options={'yield_per': BREACH_SCAN_BATCH_SIZE}
+        ).mappings()
 
-        return breached_tickets
+        return (dict(row) for row in rows)
 
     def generate_sla_report(self, db: Session, start_date: datetime, end_date: datetime, category: str = None) -> Dict:
         '''Generate comprehensive SLA performance report'''
 
-        query = db.query(Ticket).filter(
+        first_response_hours = extract('epoch', Ticket.first_response_at - Ticket.created_at) / 3600
+        resolution_hours = extract('epoch', Ticket.resolved_at - Ticket.created_at) / 3600
+
+        # Aggregate in the database so only one row comes back
+        query = select(
+            func.count(Ticket.id).label('total_tickets'),
+            func.sum(case((Ticket.first_response_at <= Ticket.first_response_due, 1), else_=0)).label('first_response_met'),
+            func.sum(case((Ticket.resolved_at <= Ticket.resolution_due, 1), else_=0)).label('resolution_met'),
+            func.avg(first_response_hours).label('avg_first_response_time'),
+            func.avg(resolution_hours).label('avg_resolution_time')
+        ).where(
             and_(
                 Ticket.created_at >= start_date,
                 Ticket.created_at <= end_date
@@ -100,43 +172,16 @@ class SLAService:
         )
 
         if category:
-            query = query.filter(Ticket.category == category)
+            query = query.where(Ticket.category == category)
 
-        tickets = query.all()
+        metrics = db.execute(query).mappings().one()
 
         # Calculate SLA metrics
-        total_tickets = len(tickets)
-        first_response_met = 0
-        resolution_met = 0
-        avg_first_response_time = 0
-        avg_resolution_time = 0
-
-        first_response_times = []
-        resolution_times = []
-
-        for ticket in tickets:
-            # First response SLA
-            if ticket.first_response_at:
-                response_time = (ticket.first_response_at - ticket.created_at).total_seconds() / 3600
-                first_response_times.append(response_time)
-
-                if ticket.first_response_at <= ticket.first_response_due:
-                    first_response_met += 1
-
-            # Resolution SLA
-            if ticket.resolved_at:
-                resolution_time = (ticket.resolved_at - ticket.created_at).total_seconds() / 3600
-                resolution_times.append(resolution_time)
-
-                if ticket.resolved_at <= ticket.resolution_due:
-                    resolution_met += 1
-
-        # Calculate averages
-        if first_response_times:
-            avg_first_response_time = sum(first_response_times) / len(first_response_times)
-
-        if resolution_times:
-            avg_resolution_time = sum(resolution_times) / len(resolution_times)
+        total_tickets = metrics['total_tickets']
+        first_response_met = int(metrics['first_response_met'] or 0)
+        resolution_met = int(metrics['resolution_met'] or 0)
+        avg_first_response_time = float(metrics['avg_first_response_time'] or 0)
+        avg_resolution_time = float(metrics['avg_resolution_time'] or 0)
 
         # SLA compliance percentages
         first_response_compliance = (first_response_met / total_tickets * 100) if total_tickets > 0 else 0
@@ -1,13 +1,18 @@
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
+from sqlalchemy import and_, func, or_, insert, update
+from datetime import datetime, timedelta, timezone
+import asyncio
+from dataclasses import dataclass
 import logging
-from typing import List, Optional
+import threading
+from typing import Dict, List, Optional
 import json
 
 from database import engine, Base, get_db
-from models import Ticket, Customer, KnowledgeBase, SLATarget, Agent
+from models import Ticket, TicketLog, Customer, KnowledgeBase, SLATarget, Agent
 from schemas import (
     TicketCreate, TicketResponse, TicketUpdate, 
     CustomerCreate, KnowledgeBaseCreate, SLAReport
@@ -15,8 +20,8 @@ from schemas import (
 from services.ticket_classifier import TicketClassifier
 from services.knowledge_searcher import KnowledgeSearcher
 from services.notification_service import NotificationService
-from services.sla_monitor import SLAMonitor
 from services.analytics_service import AnalyticsService
+from desktop import SLAService
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -40,16 +45,66 @@ app.add_middleware(
 ticket_classifier = TicketClassifier()
 knowledge_searcher = KnowledgeSearcher()
 notification_service = NotificationService()
-sla_monitor = SLAMonitor()
+sla_monitor = SLAService()
 analytics_service = AnalyticsService()
 
+# Priority escalation ladder; emergency is the ceiling
+NEXT_PRIORITY = {
+    "low": "medium",
+    "medium": "high",
+    "high": "critical",
+    "critical": "emergency",
+    "emergency": "emergency",
+}
+
+# In-memory view of available agents per specialization, refreshed in the
+# background so dispatch does not have to search the agents table
+AGENT_CACHE_REFRESH_SECONDS = 5
+SENIOR_AGENT_LEVELS = ("senior", "lead", "manager")
+# Tickets in these states no longer count towards an agent's workload
+CLOSED_TICKET_STATUSES = ("resolved", "closed")
+
+@dataclass
+class AgentSnapshot:
+    id: int
+    level: str
+    current_workload: int
+
+agent_cache: Dict[str, List[AgentSnapshot]] = {}
+agent_cache_lock = threading.Lock()
+
+# Ticket log entries are queued by the handlers and written in batches
+TICKET_LOG_FLUSH_INTERVAL_SECONDS = 0.1
+TICKET_LOG_MAX_RETRY_INTERVAL_SECONDS = 5
+TICKET_LOG_QUEUE_LIMIT = 10000
+pending_ticket_logs = []
+pending_ticket_logs_lock = threading.Lock()
+
+# Strong references to the periodic background loops; the event loop only
+# holds tasks weakly, so an unreferenced loop can be collected silently
+periodic_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup_event():
     Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        sla_monitor.load_sla_targets(db)
+    refresh_agent_cache()
+    periodic_tasks.append(asyncio.create_task(flush_ticket_logs_periodically()))
+    periodic_tasks.append(asyncio.create_task(refresh_agent_cache_periodically()))
     logger.info("HelpDesk Pro started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in periodic_tasks:
+        task.cancel()
+    await asyncio.gather(*periodic_tasks, return_exceptions=True)
+    periodic_tasks.clear()
+    
+    await asyncio.to_thread(flush_ticket_logs)
+
 @app.post("/api/tickets/", response_model=TicketResponse)
-async def create_ticket(
+def create_ticket(
     ticket: TicketCreate,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
@@ -63,6 +118,22 @@ async def create_ticket(
         customer_tier=ticket.customer_tier
     )
     
+    created_at = datetime.now(timezone.utc)
+    
+    # SLA tier comes from the customer record, not the request payload, so it
+    # matches the tier breach reporting uses
+    customer_tier = db.query(Customer.tier).filter(
+        Customer.id == ticket.customer_id
+    ).scalar() or 'standard'
+    
+    # Calculate SLA targets up front so the ticket is written in one commit
+    sla_targets = sla_monitor.calculate_sla_targets(
+        db,
+        priority=classification['priority'],
+        customer_tier=customer_tier,
+        created_at=created_at
+    )
+    
     # Create ticket with classification
     db_ticket = Ticket(
         title=ticket.title,
@@ -73,24 +144,20 @@ async def create_ticket(
         urgency=classification['urgency'],
         impact=classification['impact'],
         status='open',
-        created_at=datetime.utcnow()
+        created_at=created_at,
+        first_response_due=sla_targets['first_response'],
+        resolution_due=sla_targets['resolution']
     )
     
     # Auto-assign based on category and agent availability
-    assigned_agent = get_best_available_agent(db, classification['category'])
-    if assigned_agent:
-        db_ticket.assigned_to = assigned_agent.id
+    assigned_agent_id = get_best_available_agent(db, classification['category'])
+    if assigned_agent_id:
+        db_ticket.assigned_to = assigned_agent_id
     
     db.add(db_ticket)
     db.commit()
     db.refresh(db_ticket)
     
-    # Calculate SLA targets
-    sla_targets = sla_monitor.calculate_sla_targets(db_ticket)
-    db_ticket.first_response_due = sla_targets['first_response']
-    db_ticket.resolution_due = sla_targets['resolution']
-    db.commit()
-    
     # Background tasks
     background_tasks.add_task(
         send_ticket_notifications, 
@@ -110,7 +177,7 @@ async def create_ticket(
     return db_ticket
 
 @app.get("/api/tickets/", response_model=List[TicketResponse])
-async def get_tickets(
+def get_tickets(
     status: Optional[str] = None,
     priority: Optional[str] = None,
     category: Optional[str] = None,
@@ -136,19 +203,27 @@ async def get_tickets(
     
     # SLA breach filter
     if sla_breach is True:
-        current_time = datetime.utcnow()
+        current_time = datetime.now(timezone.utc)
         query = query.filter(
-            (Ticket.first_response_due < current_time) & 
-            (Ticket.first_response_at.is_(None)) |
-            (Ticket.resolution_due < current_time) & 
-            (Ticket.resolved_at.is_(None))
+            or_(
+                and_(
+                    Ticket.first_response_due < current_time,
+                    Ticket.first_response_at.is_(None),
+                    Ticket.status != 'closed'
+                ),
+                and_(
+                    Ticket.resolution_due < current_time,
+                    Ticket.resolved_at.is_(None),
+                    Ticket.status != 'closed'
+                )
+            )
         )
     
     tickets = query.offset(skip).limit(limit).all()
     return tickets
 
 @app.put("/api/tickets/{ticket_id}", response_model=TicketResponse)
-async def update_ticket(
+def update_ticket(
     ticket_id: int,
     ticket_update: TicketUpdate,
     background_tasks: BackgroundTasks,
@@ -160,21 +235,33 @@ async def update_ticket(
     if not db_ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
     
-    # Store original status for comparison
+    # Store original status and assignee for comparison
     original_status = db_ticket.status
+    original_assignee = db_ticket.assigned_to
     
     # Update ticket fields
     for field, value in ticket_update.dict(exclude_unset=True).items():
         setattr(db_ticket, field, value)
     
     # Track status changes and SLA compliance
+    now = datetime.now(timezone.utc)
     if ticket_update.status and ticket_update.status != original_status:
         if ticket_update.status == 'in_progress' and not db_ticket.first_response_at:
-            db_ticket.first_response_at = datetime.utcnow()
+            db_ticket.first_response_at = now
         elif ticket_update.status == 'resolved':
-            db_ticket.resolved_at = datetime.utcnow()
+            db_ticket.resolved_at = now
+    
+    db_ticket.updated_at = now
+    
+    # Move the workload slot if the ticket changed hands or was closed out
+    was_counted = original_status not in CLOSED_TICKET_STATUSES
+    is_counted = db_ticket.status not in CLOSED_TICKET_STATUSES
+    if (original_assignee, was_counted) != (db_ticket.assigned_to, is_counted):
+        if original_assignee and was_counted:
+            adjust_agent_workload(db, original_assignee, -1)
+        if db_ticket.assigned_to and is_counted:
+            adjust_agent_workload(db, db_ticket.assigned_to, 1)
     
-    db_ticket.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(db_ticket)
     
@@ -192,7 +279,7 @@ async def update_ticket(
     return db_ticket
 
 @app.post("/api/tickets/{ticket_id}/escalate")
-async def escalate_ticket(
+def escalate_ticket(
     ticket_id: int,
     escalation_reason: str,
     background_tasks: BackgroundTasks,
@@ -205,28 +292,39 @@ async def escalate_ticket(
         raise HTTPException(status_code=404, detail="Ticket not found")
     
     # Update priority and assign to senior agent
+    now = datetime.now(timezone.utc)
     original_priority = db_ticket.priority
     db_ticket.priority = escalate_priority(db_ticket.priority)
-    db_ticket.escalated_at = datetime.utcnow()
+    db_ticket.escalated_at = now
     db_ticket.escalation_reason = escalation_reason
     
-    # Find senior agent for escalation
-    senior_agent = get_senior_agent_for_category(db, db_ticket.category)
-    if senior_agent:
-        db_ticket.assigned_to = senior_agent.id
-    
-    # Log escalation
-    add_ticket_log(db, ticket_id, f"Escalated from {original_priority} to {db_ticket.priority}: {escalation_reason}")
+    # Find senior agent for escalation; the previous assignee gives up the ticket.
+    # Resolved/closed tickets hold no workload slot, so the claim is handed back.
+    senior_agent_id = get_senior_agent_for_category(db, db_ticket.category)
+    if senior_agent_id:
+        if db_ticket.status in CLOSED_TICKET_STATUSES:
+            adjust_agent_workload(db, senior_agent_id, -1)
+        elif db_ticket.assigned_to:
+            adjust_agent_workload(db, db_ticket.assigned_to, -1)
+        db_ticket.assigned_to = senior_agent_id
     
     db.commit()
     
+    # Log escalation once it is committed, so a rolled-back escalation leaves no trace
+    add_ticket_log(
+        ticket_id,
+        "escalated",
+        f"Escalated from {original_priority} to {db_ticket.priority}: {escalation_reason}",
+        created_at=now
+    )
+    
     # Notify management and customer
     background_tasks.add_task(escalate_notifications, ticket_id, escalation_reason)
     
     return {"message": f"Ticket escalated to {db_ticket.priority}", "new_priority": db_ticket.priority}
 
 @app.get("/api/knowledge-base/search")
-async def search_knowledge_base(
+def search_knowledge_base(
     query: str,
     category: Optional[str] = None,
     limit: int = 10,
@@ -248,7 +346,7 @@ async def search_knowledge_base(
     }
 
 @app.post("/api/knowledge-base/", response_model=dict)
-async def create_knowledge_article(
+def create_knowledge_article(
     article: KnowledgeBaseCreate,
     db: Session = Depends(get_db)
 ):
@@ -260,7 +358,7 @@ async def create_knowledge_article(
         category=article.category,
         tags=article.tags,
         author_id=article.author_id,
-        created_at=datetime.utcnow()
+        created_at=datetime.now(timezone.utc)
     )
     
     db.add(db_article)
@@ -273,7 +371,7 @@ async def create_knowledge_article(
     return {"message": "Knowledge article created", "id": db_article.id}
 
 @app.get("/api/analytics/dashboard")
-async def get_support_dashboard(
+def get_support_dashboard(
     days: int = 30,
     db: Session = Depends(get_db)
 ):
@@ -292,7 +390,7 @@ async def get_support_dashboard(
     }
 
 @app.get("/api/reports/sla", response_model=SLAReport)
-async def generate_sla_report(
+def generate_sla_report(
     start_date: str,
     end_date: str,
     category: Optional[str] = None,
@@ -300,32 +398,115 @@ async def generate_sla_report(
 ):
     '''Generate detailed SLA performance report'''
     
-    sla_report = sla_monitor.generate_report(
+    sla_report = sla_monitor.generate_sla_report(
         db=db,
-        start_date=datetime.fromisoformat(start_date),
-        end_date=datetime.fromisoformat(end_date),
+        start_date=parse_utc_datetime(start_date),
+        end_date=parse_utc_datetime(end_date),
         category=category
     )
     
     return sla_report
 
 # Helper functions for ticket management
-def get_best_available_agent(db: Session, category: str):
-    '''Find best available agent for ticket category'''
-    agents = db.query(Agent).filter(
+def parse_utc_datetime(value: str) -> datetime:
+    '''Parse an ISO timestamp, treating values without an offset as UTC'''
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def get_best_available_agent(db: Session, category: str) -> Optional[int]:
+    '''Find best available agent for ticket category and claim a workload slot'''
+    candidates = agent_cache.get(category)
+    if not candidates:
+        return claim_agent_from_db(db, category)
+    return claim_agent(db, candidates)
+
+def get_senior_agent_for_category(db: Session, category: str) -> Optional[int]:
+    '''Find least loaded senior agent for ticket category and claim a workload slot'''
+    candidates = [
+        agent for agent in agent_cache.get(category, [])
+        if agent.level in SENIOR_AGENT_LEVELS
+    ]
+    if not candidates:
+        return claim_agent_from_db(db, category, levels=SENIOR_AGENT_LEVELS)
+    return claim_agent(db, candidates)
+
+def claim_agent(db: Session, candidates: List[AgentSnapshot]) -> Optional[int]:
+    '''Assign the least loaded candidate that is still available'''
+    with agent_cache_lock:
+        ordered = sorted(candidates, key=lambda agent: agent.current_workload)
+    
+    for agent in ordered:
+        if increment_agent_workload(db, agent.id):
+            with agent_cache_lock:
+                agent.current_workload += 1
+            return agent.id
+    
+    return None
+
+def claim_agent_from_db(db: Session, category: str, levels: Optional[tuple] = None) -> Optional[int]:
+    '''Fallback dispatch for categories missing from the agent cache'''
+    query = db.query(Agent.id).filter(
         Agent.is_available == True,
-        Agent.categories.contains(category)
-    ).order_by(Agent.current_workload).limit(1).all()
+        Agent.specializations.contains([category])
+    )
+    if levels:
+        query = query.filter(Agent.level.in_(levels))
     
-    return agents[0] if agents else None
+    agent = query.order_by(Agent.current_workload).first()
+    if agent and increment_agent_workload(db, agent.id):
+        return agent.id
+    return None
+
+def increment_agent_workload(db: Session, agent_id: int) -> bool:
+    '''Bump an agent's workload if they are still available'''
+    claimed = db.execute(
+        update(Agent)
+        .where(Agent.id == agent_id, Agent.is_available == True)
+        .values(current_workload=Agent.current_workload + 1)
+        .returning(Agent.id)
+    ).scalar()
+    return claimed is not None
+
+def adjust_agent_workload(db: Session, agent_id: int, delta: int):
+    '''Shift an agent's workload by delta, never below zero'''
+    db.execute(
+        update(Agent)
+        .where(Agent.id == agent_id)
+        .values(current_workload=func.greatest(Agent.current_workload + delta, 0))
+    )
+
+def refresh_agent_cache():
+    '''Rebuild the specialization -> available agents map from the database'''
+    global agent_cache
+    
+    with Session(engine) as db:
+        rows = db.query(
+            Agent.id, Agent.level, Agent.specializations, Agent.current_workload
+        ).filter(Agent.is_available == True).all()
+    
+    refreshed = {}
+    for row in rows:
+        snapshot = AgentSnapshot(id=row.id, level=row.level, current_workload=row.current_workload or 0)
+        for specialization in row.specializations or []:
+            refreshed.setdefault(specialization, []).append(snapshot)
+    
+    # Replacing the whole map reconciles any local workload increments
+    agent_cache = refreshed
+
+async def refresh_agent_cache_periodically():
+    '''Keep the agent cache in step with the agents table'''
+    while True:
+        await asyncio.sleep(AGENT_CACHE_REFRESH_SECONDS)
+        try:
+            await asyncio.to_thread(refresh_agent_cache)
+        except Exception:
+            logger.exception("Failed to refresh agent cache")
 
 def escalate_priority(current_priority: str) -> str:
     '''Escalate ticket priority'''
-    priority_levels = ["low", "medium", "high", "critical", "emergency"]
-    current_index = priority_levels.index(current_priority)
-    if current_index < len(priority_levels) - 1:
-        return priority_levels[current_index + 1]
-    return current_priority
+    return NEXT_PRIORITY.get(current_priority, current_priority)
 
 async def send_ticket_notifications(ticket_id: int, action: str):
     '''Send notifications for ticket updates'''
@@ -335,4 +516,100 @@ async def send_ticket_notifications(ticket_id: int, action: str):
 async def suggest_knowledge_articles(ticket_id: int):
     '''Suggest relevant knowledge articles for ticket'''
     # AI-powered article suggestions
-    pass
\ No newline at end of file
+    pass
+
+def update_customer_metrics(customer_id: int):
+    '''Increment the customer's ticket count in place'''
+    with Session(engine) as db:
+        db.execute(
+            update(Customer)
+            .where(Customer.id == customer_id)
+            .values(total_tickets=Customer.total_tickets + 1)
+        )
+        db.commit()
+
+def add_ticket_log(
+    ticket_id: int,
+    action: str,
+    description: str,
+    created_by: Optional[int] = None,
+    created_at: Optional[datetime] = None
+):
+    '''Queue a ticket log entry for the next batch insert'''
+    with pending_ticket_logs_lock:
+        pending_ticket_logs.append({
+            'ticket_id': ticket_id,
+            'action': action,
+            'description': description,
+            'created_by': created_by,
+            'created_at': created_at or datetime.now(timezone.utc)
+        })
+        dropped = trim_ticket_log_queue()
+    
+    if dropped:
+        logger.warning(f"Ticket log queue full, dropped {dropped} oldest entries")
+
+def trim_ticket_log_queue() -> int:
+    '''Drop the oldest queued entries beyond the limit; caller holds the lock'''
+    overflow = len(pending_ticket_logs) - TICKET_LOG_QUEUE_LIMIT
+    if overflow <= 0:
+        return 0
+    del pending_ticket_logs[:overflow]
+    return overflow
+
+def requeue_ticket_logs(payloads: List[dict]):
+    '''Put unwritten entries back ahead of anything queued meanwhile'''
+    with pending_ticket_logs_lock:
+        pending_ticket_logs[:0] = payloads
+        dropped = trim_ticket_log_queue()
+    
+    if dropped:
+        logger.warning(f"Ticket log queue full, dropped {dropped} oldest entries")
+
+def insert_ticket_logs(payloads: List[dict]):
+    '''Insert ticket log entries in a single executemany'''
+    with Session(engine) as db:
+        db.execute(insert(TicketLog), payloads)
+        db.commit()
+
+def flush_ticket_logs():
+    '''Write all queued ticket log entries in one round-trip'''
+    with pending_ticket_logs_lock:
+        if not pending_ticket_logs:
+            return
+        payloads = pending_ticket_logs[:]
+        pending_ticket_logs.clear()
+    
+    try:
+        insert_ticket_logs(payloads)
+        return
+    except OperationalError:
+        # Connection-level failure; keep the batch for the next attempt
+        requeue_ticket_logs(payloads)
+        raise
+    except (IntegrityError, DataError):
+        pass
+    
+    # Some entry can never be written (e.g. its ticket was deleted). Insert
+    # one by one so the rest of the batch still lands, dropping the bad ones.
+    for index, payload in enumerate(payloads):
+        try:
+            insert_ticket_logs([payload])
+        except OperationalError:
+            requeue_ticket_logs(payloads[index:])
+            raise
+        except (IntegrityError, DataError) as exc:
+            logger.error(f"Dropping ticket log for ticket #{payload['ticket_id']}: {exc}")
+
+async def flush_ticket_logs_periodically():
+    '''Drain the ticket log queue in the background'''
+    interval = TICKET_LOG_FLUSH_INTERVAL_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush_ticket_logs)
+            interval = TICKET_LOG_FLUSH_INTERVAL_SECONDS
+        except Exception:
+            logger.exception("Failed to flush ticket logs")
+            # Back off while the database is unavailable
+            interval = min(interval * 2, TICKET_LOG_MAX_RETRY_INTERVAL_SECONDS)
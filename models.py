@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float, Index, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -31,7 +32,7 @@ class Agent(Base):
     name = Column(String(255), nullable=False)
     email = Column(String(255), unique=True, index=True)
     level = Column(String(20), default="junior")  # junior, senior, lead, manager
-    specializations = Column(JSON)  # List of specialization areas
+    specializations = Column(ARRAY(String(100)))  # List of specialization areas
     is_available = Column(Boolean, default=True)
     current_workload = Column(Integer, default=0)
     
@@ -43,6 +44,11 @@ class Agent(Base):
     # Relationships
     assigned_tickets = relationship("Ticket", back_populates="agent")
 
+    # GIN index so category lookups on specializations are index probes
+    __table_args__ = (
+        Index('ix_agent_categories_gin', 'specializations', postgresql_using='gin'),
+    )
+
 class Ticket(Base):
     __tablename__ = "tickets"
     
@@ -87,6 +93,22 @@ class Ticket(Base):
     agent = relationship("Agent", back_populates="assigned_tickets")
     logs = relationship("TicketLog", back_populates="ticket")
 
+    # Composite indexes for the ticket list filters; the partial indexes
+    # mirror the SLA breach predicates so breach scans only touch open tickets
+    __table_args__ = (
+        Index('ix_tickets_status_priority_assigned', 'status', 'priority', 'assigned_to'),
+        Index('ix_tickets_status_category_created', 'status', 'category', 'created_at'),
+        Index('ix_tickets_created_category', 'created_at', 'category'),
+        Index(
+            'ix_tickets_open_first_resp_due', 'first_response_due',
+            postgresql_where=text("first_response_at IS NULL AND status <> 'closed'")
+        ),
+        Index(
+            'ix_tickets_open_resolution_due', 'resolution_due',
+            postgresql_where=text("resolved_at IS NULL AND status <> 'closed'")
+        ),
+    )
+
 class TicketLog(Base):
     __tablename__ = "ticket_logs"
     
@@ -107,7 +129,7 @@ class KnowledgeBase(Base):
     title = Column(String(500), nullable=False)
     content = Column(Text, nullable=False)
     category = Column(String(100), index=True)
-    tags = Column(JSON)  # List of tags
+    tags = Column(ARRAY(String(64)))  # List of tags
     
     # Metadata
     author_id = Column(Integer, ForeignKey("agents.id"))
@@ -118,6 +140,11 @@ class KnowledgeBase(Base):
     view_count = Column(Integer, default=0)
     helpful_votes = Column(Integer, default=0)
     not_helpful_votes = Column(Integer, default=0)
+
+    # GIN index so tag containment/overlap queries are index probes
+    __table_args__ = (
+        Index('ix_kb_tags_gin', 'tags', postgresql_using='gin'),
+    )
     
 class SLATarget(Base):
     __tablename__ = "sla_targets"